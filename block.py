@@ -8,9 +8,10 @@
 #  WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
 #  IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from time import time
+from time import time as current_time
 
 from utility.printable import Printable
+from utility.difficulty import INITIAL_DIFFICULTY
 
 
 class Block(Printable):
@@ -22,11 +23,14 @@ class Block(Printable):
         timestamp: The timestamp of the block (automatically generated by default).
         transactions: A list of transaction which are included in the block.
         proof: The proof of work number that yielded this block.
+        difficulty: The difficulty the proof of work had to meet.
     """
 
-    def __init__(self, index, previous_hash, transactions, proof, time=time()):
+    def __init__(self, index, previous_hash, transactions, proof, time=None, difficulty=INITIAL_DIFFICULTY):
         self.index = index
         self.previous_hash = previous_hash
-        self.timestamp = time
+        # Resolved per block, a time() default argument would be evaluated only once at import
+        self.timestamp = time if time is not None else current_time()
         self.transactions = transactions
         self.proof = proof
+        self.difficulty = difficulty
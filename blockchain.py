@@ -8,7 +8,7 @@
 # WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
 # IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from functools import reduce
+from collections import OrderedDict
 import hashlib as hl
 
 import json
@@ -18,12 +18,29 @@ import requests
 # Import two functions from our hash_util.py file. Omit the ".py" in the import
 from utility.hash_util import hash_block
 from utility.verification import Verification
+from utility.difficulty import INITIAL_DIFFICULTY, next_difficulty
+from utility.compression import choose_encoding, encode_json
 from block import Block
 from transaction import Transaction
 from wallet import Wallet
+from mempool import Mempool, EVICT_OLDEST
+from chain_store import ChainStore
 
 # The reward we give to miners (for creating a new block)
 MINING_REWARD = 10
+# Limits for the pool of open transactions
+MEMPOOL_MAX_TRANSACTIONS = 5000
+MEMPOOL_MAX_BYTES = 5 * 1024 * 1024
+MEMPOOL_EVICTION_POLICY = EVICT_OLDEST
+# The maximum number of open transactions included in a mined block (excluding the reward)
+MAX_BLOCK_TRANSACTIONS = 500
+# The maximum number of received blocks kept while waiting for their parents
+MAX_ORPHAN_BLOCKS = 100
+# The number of recent blocks kept in memory, older ones are archived to disk
+# (should be at least RETARGET_INTERVAL so retargeting doesn't read the archive)
+HOT_BLOCKS = 100
+# The fields a received block (as dictionary) must have
+BLOCK_FIELDS = ('index', 'previous_hash', 'transactions', 'proof', 'timestamp', 'difficulty')
 
 print(__name__)
 
@@ -34,70 +51,96 @@ class Blockchain:
 
     Attributes:
         chain: The list of blocks.
-        open_transactions (private): The list of open transactions.
+        open_transactions (private): The bounded pool of open transactions.
         hosting_node: The connected node (which runs the blockchain).
     """
 
     def __init__(self, public_key, node_id):
         """The constructor of the Blockchain class."""
-        # Our starting block for the blockchain
-        genesis_block = Block(0, '', [], 100, 0)
-        # Initializing our (empty) blockchain list
-        self.chain = [genesis_block]
+        # Initializing our (empty) blockchain, load_data adds the genesis block or the stored blocks
+        self.__chain = ChainStore(
+            'blockchain-{}-archive.txt'.format(node_id), HOT_BLOCKS)
+        # Maps sender and recipient keys to the (block index, position) of their transactions,
+        # kept in memory and growing with the number of confirmed transactions (unlike the blocks)
+        self.__address_index = {}
+        # The confirmed balance of every participant
+        self.__balances = {}
+        # The sum of the difficulties of all blocks (the work that went into the chain)
+        self.__chain_work = 0
         # Unhandled transactions
-        self.__open_transactions = []
+        self.__open_transactions = Mempool(
+            MEMPOOL_MAX_TRANSACTIONS, MEMPOOL_MAX_BYTES, MEMPOOL_EVICTION_POLICY)
         self.public_key = public_key
         self.__peer_nodes = set()
+        # The request body encoding each peer accepts (None = uncompressed), learned from its responses
+        self.__peer_encodings = {}
+        # Received blocks which don't connect yet, keyed by their previous_hash
+        self.__orphan_blocks = OrderedDict()
         self.node_id = node_id
         self.resolve_conflicts = False
         self.load_data()
 
     # This turns the chain attribute into a property with a getter
     # (the method below) and a setter (@chain.setter)
+    # The getter reads archived blocks back from disk, prefer get_block and get_last_blockchain_value
     @property
     def chain(self):
-        return self.__chain[:]
+        return list(self.__chain)
 
     # The setter for the chain property
     @chain.setter
     def chain(self, val):
-        self.__chain = val
+        self.__chain.replace(val)
+        self.__rebuild_derived_state()
 
     def get_open_transactions(self):
         """Returns a copy of the open transactions list."""
-        return self.__open_transactions[:]
+        return self.__open_transactions.transactions
 
     def load_data(self):
         """Initialize blockchain + open transactions data from a file."""
+        # Our starting block for the blockchain
+        genesis_block = Block(0, '', [], 100, 0, INITIAL_DIFFICULTY)
+        recent_blocks = [genesis_block]
         try:
             with open('blockchain-{}.txt'.format(self.node_id), mode='r') as f:
                 file_content = f.readlines()
+                # The file holds the blocks which are not archived yet
                 blockchain = json.loads(file_content[0][:-1])
                 # We need to convert  the loaded data because Transactions should use OrderedDict
                 updated_blockchain = []
                 for block in blockchain:
+                    if 'difficulty' not in block:
+                        # Those blocks were hashed without a difficulty and can't be converted,
+                        # refuse to start instead of overwriting the file with a new chain
+                        raise ValueError(
+                            'blockchain-{}.txt was written by an older version (blocks without difficulty). '
+                            'Move it away to start a new chain.'.format(self.node_id))
                     converted_tx = [Transaction(
                         tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
                         for tx in block['transactions']]
                     updated_block = Block(
                         block['index'], block['previous_hash'], converted_tx,
-                        block['proof'], block['timestamp'])
+                        block['proof'], block['timestamp'], block['difficulty'])
                     updated_blockchain.append(updated_block)
-                self.chain = updated_blockchain
+                recent_blocks = updated_blockchain
                 open_transactions = json.loads(file_content[1][:-1])
                 # We need to convert  the loaded data because Transactions should use OrderedDict
-                updated_transactions = []
+                self.__open_transactions.clear()
                 for tx in open_transactions:
                     updated_transaction = Transaction(
                         tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
-                    updated_transactions.append(updated_transaction)
-                self.__open_transactions = updated_transactions
+                    self.__open_transactions.add(updated_transaction)
                 peer_nodes = json.loads(file_content[2])
                 self.__peer_nodes = set(peer_nodes)
         except (IOError, IndexError):
             pass
         finally:
             print('Cleanup!')
+        self.__chain.load(recent_blocks)
+        if len(self.__chain) == 0:
+            self.__chain.replace([genesis_block])
+        self.__rebuild_derived_state()
 
     def save_data(self):
         """Save blockchain + open transactions snapshot to a file."""
@@ -106,25 +149,41 @@ class Blockchain:
                 saveable_chain = [block.__dict__ for block in [Block(
                     block_el.index, block_el.previous_hash,
                     [tx.__dict__ for tx in block_el.transactions],
-                    block_el.proof, block_el.timestamp) for block_el in self.__chain]]
+                    block_el.proof, block_el.timestamp, block_el.difficulty) for block_el in self.__chain.recent()]]
                 f.write(json.dumps(saveable_chain))
                 f.write('\n')
-                saveable_tx = [tx.__dict__ for tx in self.__open_transactions]
+                saveable_tx = [
+                    tx.__dict__ for tx in self.__open_transactions.transactions]
                 f.write(json.dumps(saveable_tx))
                 f.write('\n')
                 f.write(json.dumps(list(self.__peer_nodes)))
         except IOError:
             print('Saving failed!')
 
-    def proof_of_work(self):
+    def get_block_template(self):
+        """Return the open transactions which go into the next mined block."""
+        return self.__open_transactions.select(MAX_BLOCK_TRANSACTIONS)
+
+    def get_next_difficulty(self):
+        """Return the difficulty the next block must be mined with."""
+        return next_difficulty(self.__chain, len(self.__chain))
+
+    def proof_of_work(self, transactions=None, difficulty=None):
         """Generate a proof of work for the open transactions, the hash
         of the previous block and a random number (which is guessed until it fits).
+
+        Arguments:
+            transactions: The transactions of the block (default = the block template).
+            difficulty: The difficulty of the block (default = the next block's difficulty).
         """
-        last_block = self.__chain[-1]
-        last_hash = hash_block(last_block)
+        if transactions is None:
+            transactions = self.get_block_template()
+        if difficulty is None:
+            difficulty = self.get_next_difficulty()
+        last_hash = self.__chain.tip_hash
         proof = 0
         # Try different PoW numbers and return the first valid one
-        while not Verification.valid_proof(self.__open_transactions, last_hash, proof):
+        while not Verification.valid_proof(transactions, last_hash, proof, difficulty):
             proof += 1
         return proof
 
@@ -137,31 +196,67 @@ class Blockchain:
             participant = self.public_key
         else:
             participant = sender
-        # Fetch a list of all sent coin amounts for the given person
-        # (empty lists are returned if the person was NOT the sender).
-        # This fetches sent amounts of transactions that were already
-        # included in blocks of the blockchain
-        tx_sender = [[tx.amount for tx in block.transactions
-                      if tx.sender == participant] for block in self.__chain]
-        # Fetch a list of all sent coin amounts for the given person
-        # (empty lists are returned if the person was NOT the sender).
-        # This fetches sent amounts of open transactions (to avoid double spending)
-        open_tx_sender = [tx.amount
-                          for tx in self.__open_transactions if tx.sender == participant]
-        tx_sender.append(open_tx_sender)
-        print(tx_sender)
-        amount_sent = reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt)
-                             if len(tx_amt) > 0 else tx_sum + 0, tx_sender, 0)
-        # This fetches received coin amounts of transactions that were
-        # already included in blocks of the blockchain.
-        # We ignore open transactions here because you shouldn't be able
+        # The balance of transactions that were already included in blocks
+        # of the blockchain is kept up to date as blocks are added
+        amount_confirmed = self.__balances.get(participant, 0)
+        # Subtract the sent amounts of open transactions (to avoid double spending)
+        # We ignore received open transactions because you shouldn't be able
         # to spend coins before the transaction was confirmed + included in a block.
-        tx_recipient = [[tx.amount for tx in block.transactions
-                         if tx.recipient == participant] for block in self.__chain]
-        amount_received = reduce(lambda tx_sum, tx_amt: tx_sum + sum(tx_amt)
-                                 if len(tx_amt) > 0 else tx_sum + 0, tx_recipient, 0)
+        amount_pending = self.__open_transactions.sent_amount(participant)
         # Return the total balance
-        return amount_received - amount_sent
+        return amount_confirmed - amount_pending
+
+    def __index_block(self, block):
+        """Add a block to the address index, the balances and the chain work."""
+        # The genesis block is the same for every chain and took no work
+        if block.index > 0:
+            self.__chain_work += block.difficulty
+        for position, tx in enumerate(block.transactions):
+            for key in set([tx.sender, tx.recipient]):
+                self.__address_index.setdefault(
+                    key, []).append((block.index, position))
+            self.__balances[tx.sender] = self.__balances.get(
+                tx.sender, 0) - tx.amount
+            self.__balances[tx.recipient] = self.__balances.get(
+                tx.recipient, 0) + tx.amount
+
+    def __rebuild_derived_state(self):
+        """Rebuild the address index, the balances and the chain work from the whole chain."""
+        self.__address_index = {}
+        self.__balances = {}
+        self.__chain_work = 0
+        for block in self.__chain:
+            self.__index_block(block)
+
+    def get_address_transactions(self, key, offset=0, limit=50):
+        """Return the total number of transactions sent or received by a key
+        and one page of them (oldest first).
+
+        Arguments:
+            key: The public key of the participant.
+            offset: The number of transactions to skip (default = 0).
+            limit: The maximum number of transactions returned (default = 50).
+        """
+        locations = self.__address_index.get(key, [])
+        page = []
+        for block_index, position in locations[offset:offset + limit]:
+            page.append((block_index, position,
+                         self.__chain[block_index].transactions[position]))
+        return len(locations), page
+
+    def get_block(self, index):
+        """Return the block at the given index or None if there is none.
+
+        Arguments:
+            index: The index of the block.
+        """
+        if index < 0 or index >= len(self.__chain):
+            return None
+        return self.__chain[index]
+
+    def get_last_hash(self):
+        """Return the hash of the last block."""
+        return self.__chain.tip_hash
 
     def get_last_blockchain_value(self):
         """ Returns the last value of the current blockchain. """
@@ -182,17 +277,22 @@ class Blockchain:
         """
         transaction = Transaction(sender, recipient, signature, amount)
         if Verification.verify_transaction(transaction, self.get_balance):
-            self.__open_transactions.append(transaction)
+            if not self.__open_transactions.add(transaction):
+                print('Mempool is full, transaction dropped')
+                return False
             self.save_data()
             if not is_receiving:
+                payload = {
+                    'sender': sender,
+                    'recipient': recipient,
+                    'amount': amount,
+                    'signature': signature}
+                # The encoded bodies are the same for all peers
+                bodies = {}
                 for node in self.__peer_nodes:
-                    url = 'http://{}/broadcast-transaction'.format(node)
                     try:
-                        response = requests.post(url, json={
-                                                 'sender': sender,
-                                                 'recipient': recipient,
-                                                 'amount': amount,
-                                                 'signature': signature})
+                        response = self.__post_to_peer(
+                            node, '/broadcast-transaction', payload, bodies)
                         if response.status_code == 400 or response.status_code == 500:
                             print('Transaction declined, needs resolving')
                             return False
@@ -206,32 +306,38 @@ class Blockchain:
         # Fetch the currently last block of the blockchain
         if self.public_key == None:
             return None
-        last_block = self.__chain[-1]
-        # Hash the last block (=> to be able to compare it to the stored hash value)
-        hashed_block = hash_block(last_block)
-        proof = self.proof_of_work()
+        # The hash of the last block is kept by the chain store
+        hashed_block = self.__chain.tip_hash
+        # Only a capped number of open transactions goes into the block, so mining cost stays bounded
+        copied_transactions = self.get_block_template()
+        difficulty = self.get_next_difficulty()
+        proof = self.proof_of_work(copied_transactions, difficulty)
         # Miners should be rewarded, so let's create a reward transaction
         reward_transaction = Transaction(
             'MINING', self.public_key, '', MINING_REWARD)
-        # Copy transaction instead of manipulating the original open_transactions list
-        # This ensures that if for some reason the mining should fail, we don't have the reward transaction stored in the open transactions
-        copied_transactions = self.__open_transactions[:]
+        # The template is a copy, so if for some reason the mining should fail, we don't have the reward transaction stored in the open transactions
         for tx in copied_transactions:
             if not Wallet.verify_transaction(tx):
                 return None
-        copied_transactions.append(reward_transaction)
+        block_transactions = copied_transactions + [reward_transaction]
         block = Block(len(self.__chain), hashed_block,
-                      copied_transactions, proof)
+                      block_transactions, proof, difficulty=difficulty)
         self.__chain.append(block)
-        self.__open_transactions = []
+        self.__index_block(block)
+        # Transactions which did not fit into the block stay open
+        for tx in copied_transactions:
+            self.__open_transactions.remove(tx)
         self.save_data()
+        converted_block = block.__dict__.copy()
+        converted_block['transactions'] = [tx.__dict__
+                                           for tx in converted_block['transactions']]
+        payload = {'block': converted_block, 'node_id': self.node_id}
+        # The block is encoded once per encoding and sent to all peers
+        bodies = {}
         for node in self.__peer_nodes:
-            url = 'http://{}/broadcast-block'.format(node)
-            converted_block = block.__dict__.copy()
-            converted_block['transactions'] = [tx.__dict__
-                                               for tx in converted_block['transactions']]
             try:
-                response = requests.post(url, json={'block': converted_block})
+                response = self.__post_to_peer(
+                    node, '/broadcast-block', payload, bodies)
                 if response.status_code == 400 or response.status_code == 500:
                     print('Block declined, needs resolving')
                 if response.status_code == 409:
@@ -240,40 +346,169 @@ class Blockchain:
                 continue
         return block
 
+    def __post_to_peer(self, node, path, payload, bodies):
+        """POST a JSON payload to a peer, compressed with an encoding the peer accepts.
+
+        Arguments:
+            node: The node URL of the peer.
+            path: The path of the endpoint.
+            payload: The JSON serializable payload.
+            bodies: Encoded bodies by encoding, shared between the peers of one broadcast.
+        """
+        url = 'http://{}{}'.format(node, path)
+        # Peers we haven't heard from yet get gzip, which every node of this version accepts
+        encoding = self.__peer_encodings.get(node, 'gzip')
+        while True:
+            if encoding not in bodies:
+                bodies[encoding] = encode_json(payload, encoding)
+            body, headers = bodies[encoding]
+            response = requests.post(url, data=body, headers=headers)
+            # Nodes advertise the request body encodings they accept in every response
+            advertised = response.headers.get('Accept-Encoding')
+            self.__peer_encodings[node] = choose_encoding(
+                advertised) if advertised != None else None
+            if 'Content-Encoding' in headers and advertised == None and response.status_code in (400, 415):
+                # The peer doesn't understand compressed bodies, send the payload again uncompressed
+                encoding = None
+                continue
+            return response
+
     def add_block(self, block):
-        """Add a block which was received via broadcasting to the local blockchain."""
+        """Add a block which was received via broadcasting to the local blockchain.
+
+        Orphan blocks waiting for this block are connected right after it.
+        """
+        if not self.__append_block(block):
+            return False
+        self.__connect_orphans()
+        self.save_data()
+        return True
+
+    def __append_block(self, block):
+        """Validate a block (as dictionary) against the local tip and append it."""
+        # A block with missing fields is invalid
+        if any(field not in block for field in BLOCK_FIELDS):
+            return False
+        # The block has to be the one following the local tip
+        if block['index'] != len(self.__chain):
+            return False
         # Create a list of transaction objects
         transactions = [Transaction(
             tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in block['transactions']]
         # Validate the proof of work of the block and store the result (True or False) in a variable
+        # The block must use the difficulty expected at its height and a plausible timestamp
+        if block['difficulty'] != self.get_next_difficulty():
+            return False
+        if not Verification.valid_timestamp(self.__chain, len(self.__chain), block['timestamp']):
+            return False
         proof_is_valid = Verification.valid_proof(transactions[:-1],
                                                   block['previous_hash'],
-                                                  block['proof'])
+                                                  block['proof'],
+                                                  block['difficulty'])
         # Check if previous_hash stored in the block is equal to the local blockchain's last block's hash and store the result in a block
-        hashes_match = hash_block(self.chain[-1]) == block['previous_hash']
+        hashes_match = self.__chain.tip_hash == block['previous_hash']
         if not proof_is_valid or not hashes_match:
             return False
         # Create a Block object
         converted_block = Block(block['index'], block['previous_hash'],
-                                transactions, block['proof'], block['timestamp'])
+                                transactions, block['proof'], block['timestamp'],
+                                block['difficulty'])
         self.__chain.append(converted_block)
-        stored_transactions = self.__open_transactions[:]
+        self.__index_block(converted_block)
         # Check which open transactions were included in the received block and remove them
         # This could be improved by giving each transaction an ID that would uniquely identify it
-        for itx in block['transactions']:
-            for opentx in stored_transactions:
-                if opentx.sender == itx['sender'] and opentx.recipient == itx['recipient'] and opentx.amount == itx['amount'] and opentx.signature == itx['signature']:
-                    try:
-                        self.__open_transactions.remove(opentx)
-                    except ValueError:
-                        print('Item was already removed')
+        for itx in transactions:
+            self.__open_transactions.remove(itx)
+        return True
+
+    def __connect_orphans(self):
+        """Append orphan blocks for as long as one of them extends the local tip."""
+        while True:
+            orphan = self.__orphan_blocks.pop(self.__chain.tip_hash, None)
+            if orphan is None or not self.__append_block(orphan):
+                return
+
+    def __store_orphan(self, block):
+        """Keep a block until its parent arrives, evicting the oldest orphan if the pool is full."""
+        self.__orphan_blocks.pop(block['previous_hash'], None)
+        self.__orphan_blocks[block['previous_hash']] = block
+        while len(self.__orphan_blocks) > MAX_ORPHAN_BLOCKS:
+            self.__orphan_blocks.popitem(last=False)
+
+    def __valid_orphan(self, block):
+        """Check the parts of a block (as dictionary) which don't depend on its parent,
+        so made-up blocks can't fill the orphan pool."""
+        if any(field not in block for field in BLOCK_FIELDS):
+            return False
+        # Blocks ahead of the tip can't be easier than the tip
+        if not isinstance(block['difficulty'], int) or block['difficulty'] < self.__chain[-1].difficulty:
+            return False
+        transactions = [Transaction(
+            tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in block['transactions']]
+        return Verification.valid_proof(transactions[:-1], block['previous_hash'],
+                                        block['proof'], block['difficulty'])
+
+    def add_orphan_block(self, block, node=None):
+        """Keep a received block which is ahead of the local tip and fetch its
+        missing parents from the node which sent it.
+
+        Blocks (and fetched parents) without a valid proof of work at least
+        as hard as the local tip's are dropped before they reach the orphan pool.
+        Falls back to flagging the chain for a full resolve if the parents
+        can't be fetched or don't connect to the local chain.
+
+        Arguments:
+            block: The received block (as dictionary).
+            node: The node URL of the sender (default = None, nothing is fetched).
+        """
+        if not self.__valid_orphan(block):
+            return False
+        self.__store_orphan(block)
+        # Too far behind (or no sender to ask): only a full resolve can catch up
+        if node is None or block['index'] - self.__chain[-1].index > MAX_ORPHAN_BLOCKS:
+            self.resolve_conflicts = True
+            return False
+        child = block
+        # Walk back from the orphan until we reach the block following our tip
+        while child['index'] - 1 > self.__chain[-1].index:
+            url = 'http://{}/block/{}'.format(node, child['index'] - 1)
+            try:
+                response = requests.get(url)
+            except requests.exceptions.ConnectionError:
+                self.resolve_conflicts = True
+                return False
+            if response.status_code != 200:
+                self.resolve_conflicts = True
+                return False
+            parent = response.json()
+            if not self.__valid_orphan(parent) or parent['index'] != child['index'] - 1:
+                self.resolve_conflicts = True
+                return False
+            parent_block = Block(parent['index'], parent['previous_hash'],
+                                 [Transaction(
+                                     tx['sender'], tx['recipient'],
+                                     tx['signature'], tx['amount'])
+                                  for tx in parent['transactions']],
+                                 parent['proof'], parent['timestamp'],
+                                 parent['difficulty'])
+            if hash_block(parent_block) != child['previous_hash']:
+                self.resolve_conflicts = True
+                return False
+            self.__store_orphan(parent)
+            child = parent
+        self.__connect_orphans()
         self.save_data()
+        if self.__chain[-1].index < block['index']:
+            # The sender's chain forked off below our tip
+            self.resolve_conflicts = True
+            return False
         return True
 
     def resolve(self):
-        """Checks all peer nodes' blockchains and replaces the local one with longer valid ones."""
-        # Initialize the winner chain with the local chain
-        winner_chain = self.chain
+        """Checks all peer nodes' blockchains and replaces the local one with valid ones which contain more work."""
+        # Initialize the winner chain with the local chain (only its work is needed)
+        winner_chain = None
+        winner_chain_work = self.__chain_work
         replace = False
         for node in self.__peer_nodes:
             url = 'http://{}/chain'.format(node)
@@ -288,21 +523,24 @@ class Blockchain:
                                         tx['sender'], tx['recipient'],
                                         tx['signature'], tx['amount'])
                                      for tx in block['transactions']],
-                                    block['proof'], block['timestamp'])
+                                    block['proof'], block['timestamp'],
+                                    block['difficulty'])
                               for block in node_chain]
-                node_chain_length = len(node_chain)
-                local_chain_length = len(winner_chain)
-                # Store the received chain as the current winner chain if it's longer AND valid
-                if node_chain_length > local_chain_length and Verification.verify_chain(node_chain):
+                # Many blocks of made-up low difficulty must not beat fewer, harder ones
+                node_chain_work = sum(block.difficulty for block in node_chain[1:])
+                # Store the received chain as the current winner chain if it contains more work AND is valid
+                if node_chain_work > winner_chain_work and Verification.verify_chain(node_chain):
                     winner_chain = node_chain
+                    winner_chain_work = node_chain_work
                     replace = True
             except requests.exceptions.ConnectionError:
                 continue
         self.resolve_conflicts = False
-        # Replace the local chain with the winner chain
-        self.chain = winner_chain
+        # Replace the local chain with the winner chain (this also rebuilds the derived state)
         if replace:
-            self.__open_transactions = []
+            self.chain = winner_chain
+            self.__open_transactions.clear()
+        self.__connect_orphans()
         self.save_data()
         return replace
 
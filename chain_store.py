@@ -0,0 +1,222 @@
+# Pedro Gabriel Amorim Soares, 2021
+# inspired and adapted from Schwarzmueller Udemy Python course.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#  WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
+#  IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+import os
+import threading
+
+from utility.hash_util import hash_block
+from block import Block
+from transaction import Transaction
+
+
+class ChainStore:
+    """Holds the blocks of a chain, keeping only the most recent ones in memory.
+
+    Older blocks are appended to an archive file (one JSON block per line)
+    and read back through an in-memory index of their file offsets.
+    The archived count and the in-memory blocks are published together
+    under a lock, and readers open the archive under the same lock, so
+    readers on other threads see a consistent view. A replaced archive is
+    written to a new file which then takes the place of the old one, open
+    readers keep reading the old file.
+
+    Attributes:
+        path: The path of the archive file.
+        hot_blocks: The number of recent blocks kept as objects in memory.
+    """
+
+    def __init__(self, path, hot_blocks):
+        self.path = path
+        self.hot_blocks = hot_blocks
+        # File offset of each archived block (by block index), only ever extended in place
+        self.__offsets = []
+        # The blocks following the archived ones, replaced (never changed) on update
+        self.__hot = []
+        self.__tip_hash = None
+        # Guards publishing the archived count and the in-memory blocks together
+        self.__lock = threading.Lock()
+        # Serializes writers (append, replace, load)
+        self.__write_lock = threading.Lock()
+
+    def __len__(self):
+        archived, hot = self.__snapshot()
+        return archived + len(hot)
+
+    def __getitem__(self, index):
+        """Return the block at a (possibly negative) index, reading it from the archive if needed."""
+        with self.__lock:
+            archived = len(self.__offsets)
+            length = archived + len(self.__hot)
+            if index < 0:
+                index += length
+            if index < 0 or index >= length:
+                raise IndexError('Block index out of range')
+            if index >= archived:
+                return self.__hot[index - archived]
+            offset = self.__offsets[index]
+            # Opened under the lock, so the file matches the offset even if the chain is replaced
+            f = open(self.path, mode='rb')
+        with f:
+            f.seek(offset)
+            return self.__to_block(json.loads(f.readline()))
+
+    def __iter__(self):
+        """Iterate over all blocks, reading the archive sequentially."""
+        with self.__lock:
+            archived = len(self.__offsets)
+            hot = self.__hot
+            f = open(self.path, mode='rb') if archived else None
+        if f is not None:
+            with f:
+                for _ in range(archived):
+                    yield self.__to_block(json.loads(f.readline()))
+        for block in hot:
+            yield block
+
+    @property
+    def tip_hash(self):
+        """The hash of the last block."""
+        return self.__tip_hash
+
+    def recent(self):
+        """Return a copy of the blocks which are kept in memory."""
+        return self.__snapshot()[1][:]
+
+    def append(self, block):
+        """Append a block and archive blocks which left the in-memory window.
+
+        Arguments:
+            block: The block which should be appended.
+        """
+        with self.__write_lock:
+            with self.__lock:
+                self.__hot = self.__hot + [block]
+                self.__tip_hash = hash_block(block)
+            self.__archive_cold()
+
+    def replace(self, blocks):
+        """Replace all blocks (and the archive) with a new chain.
+
+        Arguments:
+            blocks: The blocks of the new chain.
+        """
+        blocks = list(blocks)
+        cold_count = max(len(blocks) - self.hot_blocks, 0)
+        new_path = self.path + '.new'
+        with self.__write_lock:
+            # The new archive is written next to the old one, which readers may still use
+            offsets = []
+            try:
+                with open(new_path, mode='wb') as f:
+                    for block in blocks[:cold_count]:
+                        offsets.append(f.tell())
+                        f.write(json.dumps(self.__to_dict(block)).encode())
+                        f.write(b'\n')
+            except IOError:
+                print('Archiving blocks failed!')
+                new_path = None
+                offsets = []
+                cold_count = 0
+            with self.__lock:
+                try:
+                    if new_path is not None:
+                        os.replace(new_path, self.path)
+                    elif os.path.exists(self.path):
+                        # Keep the whole chain in memory, the old archive belongs to the replaced chain
+                        os.remove(self.path)
+                except OSError:
+                    print('Archiving blocks failed!')
+                    offsets = []
+                    cold_count = 0
+                self.__offsets = offsets
+                self.__hot = blocks[cold_count:]
+                self.__tip_hash = hash_block(blocks[-1])
+
+    def load(self, recent_blocks):
+        """Index the existing archive and keep the given blocks which follow it.
+
+        Arguments:
+            recent_blocks: The most recently saved blocks (may overlap the archive).
+        """
+        offsets = []
+        with self.__write_lock:
+            try:
+                with open(self.path, mode='rb') as f:
+                    offset = f.tell()
+                    line = f.readline()
+                    # A line without newline was cut off while writing and is dropped
+                    while line.endswith(b'\n'):
+                        offsets.append(offset)
+                        offset = f.tell()
+                        line = f.readline()
+                if len(line) > 0:
+                    with open(self.path, mode='r+b') as f:
+                        f.truncate(offset)
+            except IOError:
+                pass
+            hot = [block for block in recent_blocks if block.index >= len(offsets)]
+            with self.__lock:
+                self.__offsets = offsets
+                self.__hot = []
+            # Saved blocks which don't continue the archive belong to a replaced chain
+            if hot and (hot[0].index != len(offsets) or (
+                    offsets and hot[0].previous_hash != hash_block(self[len(offsets) - 1]))):
+                hot = []
+            with self.__lock:
+                self.__hot = hot
+            if len(self) > 0:
+                self.__tip_hash = hash_block(self[-1])
+            self.__archive_cold()
+
+    def __archive_cold(self):
+        """Move blocks beyond the in-memory window to the archive file.
+
+        Must be called with the write lock held.
+        """
+        _, hot = self.__snapshot()
+        cold_count = len(hot) - self.hot_blocks
+        if cold_count < 1:
+            return
+        # Blocks are written and flushed before they are published as archived,
+        # until then readers keep using the in-memory copies
+        new_offsets = []
+        try:
+            with open(self.path, mode='ab') as f:
+                for block in hot[:cold_count]:
+                    new_offsets.append(f.tell())
+                    f.write(json.dumps(self.__to_dict(block)).encode())
+                    f.write(b'\n')
+                f.flush()
+        except IOError:
+            print('Archiving blocks failed!')
+            return
+        with self.__lock:
+            self.__offsets.extend(new_offsets)
+            self.__hot = self.__hot[len(new_offsets):]
+
+    def __snapshot(self):
+        """Return the number of archived blocks and the in-memory blocks as a consistent pair."""
+        with self.__lock:
+            return len(self.__offsets), self.__hot
+
+    @staticmethod
+    def __to_dict(block):
+        dict_block = block.__dict__.copy()
+        dict_block['transactions'] = [tx.__dict__ for tx in block.transactions]
+        return dict_block
+
+    @staticmethod
+    def __to_block(block):
+        converted_tx = [Transaction(
+            tx['sender'], tx['recipient'], tx['signature'], tx['amount'])
+            for tx in block['transactions']]
+        return Block(block['index'], block['previous_hash'], converted_tx,
+                     block['proof'], block['timestamp'], block['difficulty'])
@@ -0,0 +1,243 @@
+# Pedro Gabriel Amorim Soares, 2021
+# inspired and adapted from Schwarzmueller Udemy Python course.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#  WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
+#  IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Starts a local cluster of nodes, drives a transaction and mining workload
+against it and reports throughput, propagation latency, resolve time and
+whether all nodes agree on the final chain.
+
+Usage: <python> cluster.py -n 3 -t 200 -m 20 -c 4
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep, time
+
+import requests
+
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'node.py')
+
+
+class Cluster:
+    """A set of node.py processes running on localhost.
+
+    Attributes:
+        ports: The ports the nodes listen on.
+        data_dir: The directory holding one working directory per node.
+        public_keys: The wallet public key of each node (by port).
+    """
+
+    def __init__(self, size, base_port, data_dir):
+        self.ports = [base_port + i for i in range(size)]
+        self.data_dir = data_dir
+        self.public_keys = {}
+        self.__processes = []
+        self.__logs = []
+
+    def url(self, port, path):
+        return 'http://localhost:{}{}'.format(port, path)
+
+    def start(self, timeout=30):
+        """Start every node in its own working directory and wait until they respond."""
+        for port in self.ports:
+            node_dir = os.path.join(self.data_dir, 'node-{}'.format(port))
+            os.makedirs(node_dir, exist_ok=True)
+            log = open(os.path.join(node_dir, 'node.log'), mode='w')
+            self.__logs.append(log)
+            self.__processes.append(subprocess.Popen(
+                [sys.executable, NODE_SCRIPT, '-p', str(port)],
+                cwd=node_dir, stdout=log, stderr=subprocess.STDOUT))
+        deadline = perf_counter() + timeout
+        for port in self.ports:
+            while True:
+                try:
+                    requests.get(self.url(port, '/nodes'))
+                    break
+                except requests.exceptions.ConnectionError:
+                    if perf_counter() > deadline:
+                        raise RuntimeError(
+                            'Node on port {} did not start'.format(port))
+                    sleep(0.1)
+
+    def stop(self):
+        """Terminate all node processes."""
+        for process in self.__processes:
+            process.terminate()
+        for process in self.__processes:
+            process.wait()
+        for log in self.__logs:
+            log.close()
+        self.__processes = []
+        self.__logs = []
+
+    def setup(self):
+        """Create a wallet on every node and connect every node to all others."""
+        for port in self.ports:
+            response = requests.post(self.url(port, '/wallet'))
+            self.public_keys[port] = response.json()['public_key']
+        for port in self.ports:
+            for peer in self.ports:
+                if peer != port:
+                    requests.post(self.url(port, '/node'),
+                                  json={'node': 'localhost:{}'.format(peer)})
+
+    def mine(self, port, timeout=30):
+        """Mine a block on one node and wait until every node serves it.
+
+        Returns the mining time (from sending the mine request until the block
+        was created after its proof of work, None if mining failed) and the
+        propagation time (from the block's creation until all nodes served it,
+        None if they never did). The block timestamp is comparable because all
+        nodes run on this host.
+        """
+        start = time()
+        response = requests.post(self.url(port, '/mine'))
+        if response.status_code != 201:
+            return None, None
+        block = response.json()['block']
+        mining_time = block['timestamp'] - start
+        deadline = perf_counter() + timeout
+        pending = set(self.ports)
+        while pending and perf_counter() < deadline:
+            for peer in list(pending):
+                if requests.get(self.url(peer, '/block/{}'.format(block['index']))).status_code == 200:
+                    pending.discard(peer)
+            if pending:
+                sleep(0.01)
+        if pending:
+            return mining_time, None
+        return mining_time, time() - block['timestamp']
+
+    def send(self, port, recipient, amount):
+        """Send a transaction from the wallet of one node.
+
+        Returns whether the transaction was accepted.
+        """
+        response = requests.post(self.url(port, '/transaction'),
+                                 json={'recipient': recipient, 'amount': amount})
+        return response.status_code == 201
+
+    def resolve(self, port):
+        """Trigger conflict resolution on one node and return how long it took."""
+        start = perf_counter()
+        requests.post(self.url(port, '/resolve-conflicts'))
+        return perf_counter() - start
+
+    def chains(self):
+        """Fetch the chain of every node."""
+        return {port: requests.get(self.url(port, '/chain')).json()
+                for port in self.ports}
+
+
+def run_workload(cluster, transactions, mine_every, amount, clients=1):
+    """Fund every node, then send transactions round robin from several
+    concurrent clients and mine periodically. Returns a dictionary with the
+    collected measurements.
+    """
+    mining_times = []
+    latencies = []
+
+    def mine(port):
+        mining_time, latency = cluster.mine(port)
+        if mining_time is not None:
+            mining_times.append(mining_time)
+        if latency is not None:
+            latencies.append(latency)
+
+    # Every node mines once so that it has coins to send
+    for port in cluster.ports:
+        mine(port)
+
+    def send(i):
+        sender = cluster.ports[i % len(cluster.ports)]
+        recipient = cluster.ports[(i + 1) % len(cluster.ports)]
+        return cluster.send(sender, cluster.public_keys[recipient], amount)
+
+    accepted = 0
+    miner = 0
+    elapsed = 0.0
+    batch_size = mine_every or transactions
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        # Transactions are sent in batches between mined blocks, only the batches are timed
+        for batch_start in range(0, transactions, batch_size):
+            batch = range(batch_start, min(batch_start + batch_size, transactions))
+            start = perf_counter()
+            accepted += sum(executor.map(send, batch))
+            elapsed += perf_counter() - start
+            if mine_every and len(batch) == mine_every:
+                mine(cluster.ports[miner % len(cluster.ports)])
+                miner += 1
+    resolve_times = [cluster.resolve(port) for port in cluster.ports]
+    chains = cluster.chains()
+    distinct = {str(chain) for chain in chains.values()}
+    return {
+        'accepted': accepted,
+        'declined': transactions - accepted,
+        'tps': accepted / elapsed if elapsed > 0 else 0.0,
+        'mined': len(mining_times),
+        'propagated': len(latencies),
+        'mining_times': mining_times,
+        'latencies': latencies,
+        'resolve_times': resolve_times,
+        'chain_lengths': {port: len(chain) for port, chain in chains.items()},
+        'agreement': len(distinct) == 1,
+    }
+
+
+def print_report(report):
+    print('Transactions accepted: {} (declined: {})'.format(
+        report['accepted'], report['declined']))
+    print('Accepted TPS (wall clock): {:.2f}'.format(report['tps']))
+    mining_times = sorted(report['mining_times'])
+    if mining_times:
+        print('Mining time (s): min {:.3f} / median {:.3f} / max {:.3f}'.format(
+            mining_times[0], mining_times[len(mining_times) // 2], mining_times[-1]))
+    latencies = sorted(report['latencies'])
+    print('Blocks propagated to all nodes: {}/{}'.format(
+        report['propagated'], report['mined']))
+    if latencies:
+        print('Propagation latency (s): min {:.3f} / median {:.3f} / max {:.3f}'.format(
+            latencies[0], latencies[len(latencies) // 2], latencies[-1]))
+    resolve_times = report['resolve_times']
+    print('Resolve time (s): mean {:.3f} / max {:.3f}'.format(
+        sum(resolve_times) / len(resolve_times), max(resolve_times)))
+    print('Chain lengths: {}'.format(report['chain_lengths']))
+    print('All nodes agree on the chain: {}'.format(report['agreement']))
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('-n', '--nodes', type=int, default=3)
+    parser.add_argument('-p', '--base-port', type=int, default=5100)
+    parser.add_argument('-t', '--transactions', type=int, default=100)
+    parser.add_argument('-m', '--mine-every', type=int, default=20,
+                        help='Mine a block after this many transactions (0 = never).')
+    parser.add_argument('-a', '--amount', type=float, default=0.01)
+    parser.add_argument('-c', '--clients', type=int, default=4,
+                        help='Number of concurrent clients sending transactions.')
+    parser.add_argument('-d', '--data-dir', default=None,
+                        help='Keep node data in this directory instead of a temporary one.')
+    args = parser.parse_args()
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix='cluster-')
+    cluster = Cluster(args.nodes, args.base_port, data_dir)
+    try:
+        cluster.start()
+        cluster.setup()
+        report = run_workload(cluster, args.transactions,
+                              args.mine_every, args.amount, args.clients)
+    finally:
+        cluster.stop()
+        if args.data_dir is None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+    print_report(report)
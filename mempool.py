@@ -0,0 +1,168 @@
+# Pedro Gabriel Amorim Soares, 2021
+# inspired and adapted from Schwarzmueller Udemy Python course.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+#  WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
+#  IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+from collections import OrderedDict
+import heapq
+from itertools import count, islice
+import json
+from time import time
+
+# Available eviction policies
+EVICT_OLDEST = 'age'
+EVICT_LOWEST_VALUE = 'lowest-value'
+
+
+class Mempool:
+    """A bounded pool of open (not yet mined) transactions.
+
+    Attributes:
+        max_count: The maximum number of transactions kept in the pool.
+        max_bytes: The maximum serialized size of all pooled transactions.
+        policy: Which transaction gets evicted when the pool is full
+            (EVICT_OLDEST or EVICT_LOWEST_VALUE).
+    """
+
+    def __init__(self, max_count, max_bytes, policy=EVICT_OLDEST):
+        if policy not in (EVICT_OLDEST, EVICT_LOWEST_VALUE):
+            raise ValueError('Unknown eviction policy: {}'.format(policy))
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.__sequence = count()
+        self.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def size_bytes(self):
+        """The serialized size of all pooled transactions."""
+        return self.__size_bytes
+
+    @property
+    def transactions(self):
+        """A copy of the pooled transactions, oldest first."""
+        return [tx for tx, _, _ in self.__entries.values()]
+
+    def sent_amount(self, sender):
+        """Return the total amount of the pooled transactions of a sender.
+
+        Arguments:
+            sender: The sender of the transactions.
+        """
+        return self.__sent.get(sender, [0, 0])[1]
+
+    def add(self, transaction):
+        """Add a transaction, evicting others if the pool would overflow.
+
+        Returns False (and leaves the pool untouched) if the transaction
+        itself would be the one evicted.
+
+        Arguments:
+            transaction: The transaction which should be added.
+        """
+        size = len(json.dumps(transaction.__dict__))
+        if size > self.max_bytes or self.max_count < 1:
+            return False
+        victims = []
+        remaining = len(self.__entries) + 1
+        size_bytes = self.__size_bytes + size
+        if remaining > self.max_count or size_bytes > self.max_bytes:
+            if self.policy == EVICT_LOWEST_VALUE:
+                # Pop the cheapest entries from the heap, they are pushed back if the new transaction loses
+                popped = []
+                while remaining > self.max_count or size_bytes > self.max_bytes:
+                    amount, sequence = heapq.heappop(self.__heap)
+                    if sequence not in self.__entries:
+                        continue
+                    popped.append((amount, sequence))
+                    if transaction.amount < amount:
+                        for item in popped:
+                            heapq.heappush(self.__heap, item)
+                        return False
+                    victims.append(sequence)
+                    remaining -= 1
+                    size_bytes -= self.__entries[sequence][2]
+            else:
+                oldest = iter(self.__entries)
+                while remaining > self.max_count or size_bytes > self.max_bytes:
+                    sequence = next(oldest)
+                    victims.append(sequence)
+                    remaining -= 1
+                    size_bytes -= self.__entries[sequence][2]
+        for sequence in victims:
+            self.__discard(sequence)
+        sequence = next(self.__sequence)
+        self.__entries[sequence] = (transaction, time(), size)
+        self.__by_key.setdefault(self.__key(transaction), []).append(sequence)
+        sent = self.__sent.setdefault(transaction.sender, [0, 0])
+        sent[0] += 1
+        sent[1] += transaction.amount
+        self.__size_bytes += size
+        if self.policy == EVICT_LOWEST_VALUE:
+            heapq.heappush(self.__heap, (transaction.amount, sequence))
+            # Drop heap items of removed transactions once they dominate the heap
+            if len(self.__heap) > 2 * len(self.__entries) + 64:
+                self.__heap = [(tx.amount, seq)
+                               for seq, (tx, _, _) in self.__entries.items()]
+                heapq.heapify(self.__heap)
+        return True
+
+    def remove(self, transaction):
+        """Remove a transaction (compared by content) from the pool.
+
+        Arguments:
+            transaction: The transaction which should be removed.
+        """
+        sequences = self.__by_key.get(self.__key(transaction))
+        if not sequences:
+            return False
+        self.__discard(sequences[0])
+        return True
+
+    def clear(self):
+        """Drop all pooled transactions."""
+        # Transactions in arrival order, together with their arrival time and size
+        self.__entries = OrderedDict()
+        # Transaction content -> sequence numbers of the pooled copies
+        self.__by_key = {}
+        # (amount, sequence number) heap for the lowest value policy, may hold removed entries
+        self.__heap = []
+        # Sender -> [number of pooled transactions, total amount]
+        self.__sent = {}
+        self.__size_bytes = 0
+
+    def select(self, max_count):
+        """Return up to max_count transactions for a block template, oldest first.
+
+        Arguments:
+            max_count: The maximum number of transactions to return.
+        """
+        return [tx for tx, _, _ in islice(self.__entries.values(), max_count)]
+
+    @staticmethod
+    def __key(transaction):
+        return (transaction.sender, transaction.recipient,
+                transaction.amount, transaction.signature)
+
+    def __discard(self, sequence):
+        """Remove the entry with the given sequence number."""
+        transaction, _, size = self.__entries.pop(sequence)
+        key = self.__key(transaction)
+        sequences = self.__by_key[key]
+        sequences.remove(sequence)
+        if not sequences:
+            del self.__by_key[key]
+        sent = self.__sent[transaction.sender]
+        sent[0] -= 1
+        sent[1] -= transaction.amount
+        if sent[0] == 0:
+            del self.__sent[transaction.sender]
+        self.__size_bytes -= size
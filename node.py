@@ -8,14 +8,70 @@
 # WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
 # IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
+import hmac
+
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
 
-from wallet import Wallet
-from blockchain import Blockchain
+from wallet import Wallet, SCHEME_RSA, SCHEME_ED25519
+from blockchain import Blockchain, BLOCK_FIELDS
+from utility.compression import (DecompressionMiddleware, PayloadCache, ACCEPTED_ENCODINGS,
+                                 MIN_COMPRESS_SIZE, choose_encoding, compress)
+from utility.hash_util import hash_block
+from utility.profiling import Profiler
+
+# Blockchain methods which can be profiled through /admin/profile
+PROFILED_METHODS = ['mine_block', 'proof_of_work', 'resolve', 'get_balance',
+                    'add_transaction', 'add_block']
 
 app = Flask(__name__)
 CORS(app)
+# Request bodies may be sent compressed (Content-Encoding)
+app.wsgi_app = DecompressionMiddleware(app.wsgi_app)
+# Serialized (and compressed) blocks, keyed by block hash
+block_cache = PayloadCache()
+# Only the most recent chain bodies are kept, they are large and superseded by every new block
+chain_cache = PayloadCache(max_entries=4)
+profiler = Profiler()
+# Admin endpoints are disabled unless a token is set (see --admin-token)
+admin_token = None
+
+
+def cached_json_response(cache, key, build):
+    """Return a JSON response for immutable data, compressed as negotiated
+    through Accept-Encoding, reusing a body previously built for key."""
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    body = cache.get(key, encoding, build)
+    response = app.response_class(body, mimetype='application/json')
+    if encoding != None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress other JSON responses if the client accepts it."""
+    # Tell peers which encodings they may use for request bodies
+    response.headers['Accept-Encoding'] = ACCEPTED_ENCODINGS
+    if (response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+    encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+    data = response.get_data()
+    if encoding == None or len(data) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def is_admin():
+    token = request.headers.get('X-Admin-Token', '')
+    # compare_digest only accepts ASCII strings, bytes work for any header value
+    return admin_token != None and hmac.compare_digest(
+        token.encode('utf-8'), admin_token.encode('utf-8'))
 
 
 @app.route('/', methods=['GET'])
@@ -30,7 +86,14 @@ def get_network_ui():
 
 @app.route('/wallet', methods=['POST'])
 def create_keys():
-    wallet.create_keys()
+    values = request.get_json(silent=True) or {}
+    scheme = values.get('scheme', wallet.scheme)
+    if scheme not in (SCHEME_RSA, SCHEME_ED25519):
+        response = {
+            'message': 'Unknown signature scheme.'
+        }
+        return jsonify(response), 400
+    wallet.create_keys(scheme)
     if wallet.save_keys():
         global blockchain
         blockchain = Blockchain(wallet.public_key, port)
@@ -122,17 +185,27 @@ def broadcast_block():
         response = {'message': 'Some data is missing.'}
         return jsonify(response), 400
     block = values['block']
-    if block['index'] == blockchain.chain[-1].index + 1:
+    if not isinstance(block, dict) or any(field not in block for field in BLOCK_FIELDS):
+        response = {'message': 'Some data is missing.'}
+        return jsonify(response), 400
+    last_block = blockchain.get_last_blockchain_value()
+    if block['index'] == last_block.index + 1:
         if blockchain.add_block(block):
             response = {'message': 'Block added'}
             return jsonify(response), 201
         else:
             response = {'message': 'Block seems invalid.'}
             return jsonify(response), 409
-    elif block['index'] > blockchain.chain[-1].index:
+    elif block['index'] > last_block.index:
+        # Keep the block as an orphan and fetch only its missing parents from the sender
+        node = None
+        if 'node_id' in values:
+            node = '{}:{}'.format(request.remote_addr, values['node_id'])
+        if blockchain.add_orphan_block(block, node):
+            response = {'message': 'Block added after fetching missing blocks.'}
+            return jsonify(response), 201
         response = {
             'message': 'Blockchain seems to differ from local blockchain.'}
-        blockchain.resolve_conflicts = True
         return jsonify(response), 200
     else:
         response = {
@@ -226,12 +299,53 @@ def get_open_transaction():
 
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_snapshot = blockchain.chain
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for dict_block in dict_chain:
+    def build():
+        # Archived blocks are only read back when the body isn't cached
+        dict_chain = [block.__dict__.copy() for block in blockchain.chain]
+        for dict_block in dict_chain:
+            dict_block['transactions'] = [
+                tx.__dict__ for tx in dict_block['transactions']]
+        return dict_chain
+    # The whole chain is identified by its last block
+    return cached_json_response(chain_cache, blockchain.get_last_hash(), build)
+
+
+@app.route('/block/<int:index>', methods=['GET'])
+def get_block(index):
+    block = blockchain.get_block(index)
+    if block == None:
+        response = {'message': 'Block not found.'}
+        return jsonify(response), 404
+
+    def build():
+        dict_block = block.__dict__.copy()
         dict_block['transactions'] = [
             tx.__dict__ for tx in dict_block['transactions']]
-    return jsonify(dict_chain), 200
+        return dict_block
+    return cached_json_response(block_cache, hash_block(block), build)
+
+
+@app.route('/address/<key>/transactions', methods=['GET'])
+def get_address_transactions(key):
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', 50, type=int)
+    if offset < 0 or limit < 1 or limit > 500:
+        response = {
+            'message': 'Invalid offset or limit.'
+        }
+        return jsonify(response), 400
+    total, page = blockchain.get_address_transactions(key, offset, limit)
+    response = {
+        'total': total,
+        'offset': offset,
+        'limit': limit,
+        'transactions': [{
+            'block': block_index,
+            'position': position,
+            'transaction': tx.__dict__
+        } for block_index, position, tx in page]
+    }
+    return jsonify(response), 200
 
 
 @app.route('/node', methods=['POST'])
@@ -280,12 +394,74 @@ def get_nodes():
     return jsonify(response), 200
 
 
+@app.route('/admin/profile', methods=['POST'])
+def arm_profiler():
+    if not is_admin():
+        response = {'message': 'Not allowed.'}
+        return jsonify(response), 403
+    values = request.get_json()
+    if not values or 'target' not in values:
+        response = {'message': 'No target found.'}
+        return jsonify(response), 400
+    target = values['target']
+    count = values.get('count', 1)
+    dump = values.get('dump', False)
+    if not isinstance(count, int) or count < 1:
+        response = {'message': 'Invalid count.'}
+        return jsonify(response), 400
+    if target in PROFILED_METHODS:
+        # The method is wrapped on the current blockchain object, loading a wallet replaces it
+        profiler.arm_method(blockchain, target, count, dump)
+    else:
+        endpoints = [rule.endpoint for rule in app.url_map.iter_rules()
+                     if rule.rule == target and not rule.rule.startswith('/admin')]
+        if not endpoints:
+            response = {'message': 'Unknown target.'}
+            return jsonify(response), 400
+        for endpoint in endpoints:
+            profiler.arm_view(app, endpoint, count, dump)
+    response = {
+        'message': 'Profiler armed.',
+        'armed': profiler.armed()
+    }
+    return jsonify(response), 201
+
+
+@app.route('/admin/profile', methods=['GET'])
+def get_profiles():
+    if not is_admin():
+        response = {'message': 'Not allowed.'}
+        return jsonify(response), 403
+    response = {
+        'armed': profiler.armed(),
+        'reports': list(profiler.reports)
+    }
+    return jsonify(response), 200
+
+
+@app.route('/admin/profile', methods=['DELETE'])
+def disarm_profiler():
+    if not is_admin():
+        response = {'message': 'Not allowed.'}
+        return jsonify(response), 403
+    profiler.disarm_all()
+    profiler.reports.clear()
+    response = {'message': 'Profiler disarmed.'}
+    return jsonify(response), 200
+
+
 if __name__ == '__main__':
     from argparse import ArgumentParser
     parser = ArgumentParser()
     parser.add_argument('-p', '--port', type=int, default=5000)
+    parser.add_argument('-s', '--scheme', default=SCHEME_RSA,
+                        choices=[SCHEME_RSA, SCHEME_ED25519])
+    parser.add_argument('--admin-token', default=None)
+    parser.add_argument('--profile-dir', default='.')
     args = parser.parse_args()
     port = args.port
-    wallet = Wallet(port)
+    admin_token = args.admin_token
+    profiler.dump_dir = args.profile_dir
+    wallet = Wallet(port, args.scheme)
     blockchain = Blockchain(wallet.public_key, port)
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,159 @@
+"""Provides HTTP body compression helpers (gzip, and zstd if zstandard is installed)."""
+
+from collections import OrderedDict
+import io
+import json
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 512
+# Compressed request bodies may not expand beyond this size
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+# Encodings we can produce, in order of preference
+SUPPORTED_ENCODINGS = ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+# Sent in responses so peers learn which request body encodings we accept
+ACCEPTED_ENCODINGS = ', '.join(SUPPORTED_ENCODINGS)
+DECOMPRESSION_ERRORS = (OSError, EOFError, ValueError, zlib.error) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def compress(data, encoding):
+    """Compress bytes with the given content encoding.
+
+    Arguments:
+        data: The bytes which should be compressed.
+        encoding: 'gzip' or 'zstd'.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(data)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data, encoding, max_size=MAX_DECOMPRESSED_SIZE):
+    """Decompress bytes with the given content encoding.
+
+    Raises ValueError if the result would be larger than max_size.
+
+    Arguments:
+        data: The compressed bytes.
+        encoding: 'gzip' or 'zstd'.
+        max_size: The maximum size of the decompressed data.
+    """
+    if encoding == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data))
+        result = reader.read(max_size + 1)
+    else:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        result = decompressor.decompress(data, max_size + 1)
+    if len(result) > max_size:
+        raise ValueError('Decompressed data is too large')
+    return result
+
+
+def choose_encoding(accept_encoding):
+    """Return the preferred supported encoding accepted by a client, or None.
+
+    Arguments:
+        accept_encoding: The value of the Accept-Encoding header.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name] = quality
+    for encoding in SUPPORTED_ENCODINGS:
+        # An explicit entry (including a refusal with q=0) takes precedence over '*'
+        if qualities.get(encoding, qualities.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def encode_json(payload, encoding='gzip'):
+    """Return the body and headers for sending a JSON payload in a request.
+
+    Arguments:
+        payload: The JSON serializable payload.
+        encoding: The content encoding used for large bodies (default = 'gzip', None = uncompressed).
+    """
+    body = json.dumps(payload).encode()
+    headers = {'Content-Type': 'application/json'}
+    if encoding is not None and len(body) >= MIN_COMPRESS_SIZE:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return body, headers
+
+
+class PayloadCache:
+    """A bounded cache of (compressed) JSON bodies of immutable data.
+
+    Attributes:
+        max_entries: The maximum number of cached bodies.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, encoding, build):
+        """Return the body cached for key and encoding, creating it if needed.
+
+        Arguments:
+            key: Identifies the (immutable) data.
+            encoding: The content encoding of the body (None = uncompressed).
+            build: Returns the data as JSON serializable object.
+        """
+        with self.__lock:
+            body = self.__entries.get((key, encoding))
+            if body is not None:
+                self.__entries.move_to_end((key, encoding))
+                return body
+        body = json.dumps(build()).encode()
+        if encoding is not None:
+            body = compress(body, encoding)
+        with self.__lock:
+            self.__entries[(key, encoding)] = body
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+        return body
+
+
+class DecompressionMiddleware:
+    """WSGI middleware which transparently decompresses request bodies
+    sent with a supported Content-Encoding.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if encoding in SUPPORTED_ENCODINGS:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            try:
+                data = decompress(environ['wsgi.input'].read(length), encoding)
+            except DECOMPRESSION_ERRORS:
+                start_response('400 Bad Request', [
+                    ('Content-Type', 'application/json'),
+                    ('Accept-Encoding', ACCEPTED_ENCODINGS)])
+                return [json.dumps({'message': 'Invalid compressed body.'}).encode()]
+            environ['wsgi.input'] = io.BytesIO(data)
+            environ['CONTENT_LENGTH'] = str(len(data))
+            del environ['HTTP_CONTENT_ENCODING']
+        return self.app(environ, start_response)
@@ -0,0 +1,64 @@
+"""Provides the proof of work difficulty and its periodic retargeting."""
+
+# The difficulty of the genesis block. The proof target is MAX_TARGET // difficulty,
+# so 256 requires 8 leading zero bits (two leading 0s in the hex digest)
+INITIAL_DIFFICULTY = 256
+# Difficulty never drops below this value
+MIN_DIFFICULTY = 1
+# The block interval (in seconds) retargeting aims for
+TARGET_BLOCK_INTERVAL = 10
+# The difficulty is retargeted every RETARGET_INTERVAL blocks
+RETARGET_INTERVAL = 10
+# A single retarget changes the difficulty by at most this factor
+MAX_RETARGET_FACTOR = 4
+# One more than the largest SHA256 digest
+MAX_TARGET = 2 ** 256
+# A block's timestamp must be later than the median timestamp of this many preceding blocks
+MEDIAN_TIME_BLOCKS = 11
+# A block's timestamp may be at most this many seconds ahead of the local clock
+MAX_FUTURE_BLOCK_TIME = 15
+
+
+def proof_target(difficulty):
+    """Return the integer a proof of work hash must be lower than.
+
+    Arguments:
+        difficulty: The difficulty of the block.
+    """
+    return MAX_TARGET // difficulty
+
+
+def next_difficulty(chain, height):
+    """Return the difficulty the block at the given height must have.
+
+    Arguments:
+        chain: The blocks preceding height (indexable by block index).
+        height: The index of the block.
+    """
+    if height < 1:
+        return INITIAL_DIFFICULTY
+    previous_difficulty = chain[height - 1].difficulty
+    if height % RETARGET_INTERVAL != 0:
+        return previous_difficulty
+    # The genesis block has no meaningful timestamp, so windows start at block 1
+    first = max(1, height - RETARGET_INTERVAL)
+    last = height - 1
+    if last <= first:
+        return previous_difficulty
+    expected_time = (last - first) * TARGET_BLOCK_INTERVAL
+    actual_time = chain[last].timestamp - chain[first].timestamp
+    actual_time = min(max(actual_time, expected_time / MAX_RETARGET_FACTOR),
+                      expected_time * MAX_RETARGET_FACTOR)
+    return max(MIN_DIFFICULTY, int(previous_difficulty * expected_time / actual_time))
+
+
+def median_time_past(chain, height):
+    """Return the median timestamp of the blocks preceding height.
+
+    Arguments:
+        chain: The blocks preceding height (indexable by block index).
+        height: The index of the block.
+    """
+    timestamps = sorted(chain[index].timestamp
+                        for index in range(max(0, height - MEDIAN_TIME_BLOCKS), height))
+    return timestamps[len(timestamps) // 2]
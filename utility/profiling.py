@@ -0,0 +1,153 @@
+"""Provides on-demand profiling of view functions and methods."""
+
+from collections import deque
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+from time import time
+
+# The number of profile reports kept in memory
+MAX_REPORTS = 20
+# The number of functions listed in a report
+REPORT_LINES = 30
+
+
+class Profiler:
+    """Profiles the next calls of a view function or method with cProfile.
+
+    A target is only wrapped while it is armed and is restored as soon as
+    its calls are used up, so targets cost nothing while not armed. Targets
+    are named 'route:<endpoint>' for view functions and 'method:<name>' for
+    methods, so a view and a method with the same name don't collide.
+
+    Attributes:
+        dump_dir: The directory profile files are written to.
+        reports: The most recent profile reports (dictionaries).
+    """
+
+    def __init__(self, dump_dir='.'):
+        self.dump_dir = dump_dir
+        self.reports = deque(maxlen=MAX_REPORTS)
+        self.__lock = threading.Lock()
+        # Target name -> [remaining calls, restore function]
+        self.__armed = {}
+        # Only one cProfile profiler can run per process (Python 3.12+), guarded by __lock
+        self.__active = False
+
+    def arm_view(self, app, endpoint, count, dump=False):
+        """Profile the next calls of a Flask view function.
+
+        Arguments:
+            app: The Flask application.
+            endpoint: The endpoint name of the view function.
+            count: The number of calls to profile.
+            dump: Whether to also write each profile to dump_dir (default = False).
+        """
+        target = 'route:{}'.format(endpoint)
+        self.disarm(target)
+        original = app.view_functions[endpoint]
+
+        def restore():
+            app.view_functions[endpoint] = original
+        self.__arm(target, original, count, dump, restore,
+                   lambda wrapper: app.view_functions.__setitem__(endpoint, wrapper))
+
+    def arm_method(self, obj, name, count, dump=False):
+        """Profile the next calls of a method of one object.
+
+        Arguments:
+            obj: The object whose method should be profiled.
+            name: The name of the method.
+            count: The number of calls to profile.
+            dump: Whether to also write each profile to dump_dir (default = False).
+        """
+        target = 'method:{}'.format(name)
+        self.disarm(target)
+        original = getattr(obj, name)
+
+        def restore():
+            # Removing the instance attribute uncovers the method of the class again
+            obj.__dict__.pop(name, None)
+        self.__arm(target, original, count, dump, restore,
+                   lambda wrapper: setattr(obj, name, wrapper))
+
+    def disarm(self, target):
+        """Stop profiling a target and restore its original function."""
+        with self.__lock:
+            entry = self.__armed.pop(target, None)
+        if entry is not None:
+            entry[1]()
+
+    def disarm_all(self):
+        """Stop profiling all targets."""
+        for target in list(self.__armed):
+            self.disarm(target)
+
+    def armed(self):
+        """Return the armed targets with their number of remaining calls."""
+        with self.__lock:
+            return {target: entry[0] for target, entry in self.__armed.items()}
+
+    def __arm(self, target, func, count, dump, restore, install):
+        entry = [count, restore]
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.__lock:
+                # Calls overlapping a running profile (nested or on other threads) just run
+                profile_call = entry[0] > 0 and not self.__active
+                if profile_call:
+                    self.__active = True
+                    entry[0] -= 1
+                    if entry[0] == 0 and self.__armed.get(target) is entry:
+                        del self.__armed[target]
+                        restore()
+            if not profile_call:
+                return func(*args, **kwargs)
+            profile = cProfile.Profile()
+            start = time()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool is active, the call runs without being recorded
+                with self.__lock:
+                    self.__active = False
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.__lock:
+                    self.__active = False
+                self.__record(target, profile, start, dump)
+
+        with self.__lock:
+            self.__armed[target] = entry
+        install(wrapper)
+
+    def __record(self, target, profile, start, dump):
+        """Store a report for a finished profile and optionally dump it to disk."""
+        stream = io.StringIO()
+        stats = pstats.Stats(profile, stream=stream)
+        stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+        report = {
+            'target': target,
+            'timestamp': start,
+            'duration': time() - start,
+            'stats': stream.getvalue(),
+            'file': None
+        }
+        if dump:
+            file_name = 'profile-{}-{}.prof'.format(
+                re.sub(r'[^A-Za-z0-9_]+', '_', target), int(start * 1000))
+            path = os.path.join(self.dump_dir, file_name)
+            try:
+                profile.dump_stats(path)
+                report['file'] = path
+            except IOError:
+                print('Saving profile failed!')
+        self.reports.append(report)
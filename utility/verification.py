@@ -1,21 +1,30 @@
 """Provides verification helper methods."""
 
 from utility.hash_util import hash_string_256, hash_block
+from time import time
+
+from utility.difficulty import (INITIAL_DIFFICULTY, MAX_FUTURE_BLOCK_TIME, median_time_past,
+                                next_difficulty, proof_target)
+from block import Block
 from wallet import Wallet
 
+# Every chain starts with this block, it has no proof of work and its difficulty doesn't count as work
+GENESIS_BLOCK_HASH = hash_block(Block(0, '', [], 100, 0, INITIAL_DIFFICULTY))
+
 
 class Verification:
     """A helper class which offer various static and class-based verification
     and validation methods.
     """
     @staticmethod
-    def valid_proof(transactions, last_hash, proof):
-        """Validate a proof of work number and see if it solves the puzzle algorithm (two leading 0s)
+    def valid_proof(transactions, last_hash, proof, difficulty=INITIAL_DIFFICULTY):
+        """Validate a proof of work number and see if it solves the puzzle algorithm (hash below the difficulty's target)
 
         Arguments:
             transactions: The transactions of the block for which the proof is created.
             last_hash: The previous block's hash which will be stored in the current block.
             proof: The proof number we're testing.
+            difficulty: The difficulty of the block (default = INITIAL_DIFFICULTY).
         """
         # Create a string with all the hash inputs
         guess = (str([tx.to_ordered_dict() for tx in transactions]
@@ -23,21 +32,43 @@ class Verification:
         # Hash the string
         # IMPORTANT: This is NOT the same hash as will be stored in the previous_hash. It's a not a block's hash. It's only used for the proof-of-work algorithm.
         guess_hash = hash_string_256(guess)
-        # Only a hash (which is based on the above inputs) which starts with two 0s is treated as valid
-        # This condition is of course defined by you. You could also require 10 leading 0s - this would take significantly longer (and this allows you to control the speed at which new blocks can be added)
-        return guess_hash[0:2] == '00'
+        # Only a hash (which is based on the above inputs) which is numerically below the target is treated as valid
+        # A higher difficulty means a lower target, which takes longer to hit (this allows you to control the speed at which new blocks can be added)
+        return int(guess_hash, 16) < proof_target(difficulty)
+
+    @staticmethod
+    def valid_timestamp(blockchain, height, timestamp):
+        """Check that a block's timestamp is later than the median of the
+        preceding blocks and not too far in the future, so retargeting can't
+        be driven by made-up block times.
+
+        Arguments:
+            blockchain: The blocks preceding the block (indexable by block index).
+            height: The index of the block.
+            timestamp: The timestamp of the block.
+        """
+        return median_time_past(blockchain, height) < timestamp <= time() + MAX_FUTURE_BLOCK_TIME
 
     @classmethod
     def verify_chain(cls, blockchain):
         """Verify the current blockchain and return True if it's valid, False
         otherwise.
         """
+        if len(blockchain) == 0 or hash_block(blockchain[0]) != GENESIS_BLOCK_HASH:
+            print('Genesis block is invalid')
+            return False
         for (index, block) in enumerate(blockchain):
             if index == 0:
                 continue
             if block.previous_hash != hash_block(blockchain[index - 1]):
                 return False
-            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof):
+            if not cls.valid_timestamp(blockchain, index, block.timestamp):
+                print('Timestamp is invalid')
+                return False
+            if block.difficulty != next_difficulty(blockchain, index):
+                print('Difficulty is invalid')
+                return False
+            if not cls.valid_proof(block.transactions[:-1], block.previous_hash, block.proof, block.difficulty):
                 print('Proof of work is invalid')
                 return False
         return True
@@ -8,24 +8,44 @@
 #  WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR
 #  IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from functools import lru_cache
+
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import PKCS1_v1_5, eddsa
 from Crypto.Hash import SHA256
 import Crypto.Random
 import binascii
 
+# Supported signature schemes
+SCHEME_RSA = 'rsa'
+SCHEME_ED25519 = 'ed25519'
+# The algorithm identifier (OID 1.3.101.112) of DER encoded Ed25519 keys
+ED25519_OID = '06032b6570'
+
 
 class Wallet:
-    """Creates, loads and holds private and public keys. Manages transaction signing and verification."""
+    """Creates, loads and holds private and public keys. Manages transaction signing and verification.
+
+    Attributes:
+        scheme: The signature scheme used for newly created keys (SCHEME_RSA or SCHEME_ED25519).
+    """
 
-    def __init__(self, node_id):
+    def __init__(self, node_id, scheme=SCHEME_RSA):
         self.private_key = None
         self.public_key = None
         self.node_id = node_id
+        self.scheme = scheme
+        # The parsed signer for the current private key (see sign_transaction)
+        self.__signer = None
+        self.__signer_key = None
 
-    def create_keys(self):
-        """Create a new pair of private and public keys."""
-        private_key, public_key = self.generate_keys()
+    def create_keys(self, scheme=None):
+        """Create a new pair of private and public keys.
+
+        Arguments:
+            scheme: The signature scheme to use (default = the wallet's scheme).
+        """
+        private_key, public_key = self.generate_keys(scheme or self.scheme)
         self.private_key = private_key
         self.public_key = public_key
 
@@ -56,13 +76,41 @@ class Wallet:
             print('Loading wallet failed...')
             return False
 
-    def generate_keys(self):
-        """Generate a new pair of private and public key."""
+    def generate_keys(self, scheme=SCHEME_RSA):
+        """Generate a new pair of private and public key.
+
+        Arguments:
+            scheme: The signature scheme of the keys (default = SCHEME_RSA).
+        """
+        if scheme == SCHEME_ED25519:
+            private_key = ECC.generate(curve='Ed25519')
+            public_key = private_key.public_key()
+            return (binascii.hexlify(private_key.export_key(format='DER')).decode('ascii'),
+                    binascii.hexlify(public_key.export_key(format='DER')).decode('ascii'))
+        if scheme != SCHEME_RSA:
+            raise ValueError('Unknown signature scheme: {}'.format(scheme))
         private_key = RSA.generate(1024, Crypto.Random.new().read)
         public_key = private_key.publickey()
         return (binascii.hexlify(private_key.exportKey(format='DER')).decode('ascii'),
                 binascii.hexlify(public_key.exportKey(format='DER')).decode('ascii'))
 
+    @staticmethod
+    def key_scheme(key):
+        """Return the signature scheme of a hex encoded DER key.
+
+        Arguments:
+            key: The (public or private) key.
+        """
+        # Public keys (SubjectPublicKeyInfo) carry the OID at byte 4, private keys (PKCS#8) at byte 7
+        if key[8:18] == ED25519_OID or key[14:24] == ED25519_OID:
+            return SCHEME_ED25519
+        return SCHEME_RSA
+
+    @staticmethod
+    def transaction_message(sender, recipient, amount):
+        """Return the bytes which are signed for a transaction."""
+        return (str(sender) + str(recipient) + str(amount)).encode('utf8')
+
     def sign_transaction(self, sender, recipient, amount):
         """Sign a transaction and return the signature.
 
@@ -71,11 +119,19 @@ class Wallet:
             recipient: The recipient of the transaction.
             amount: The amount of the transaction.
         """
-        signer = PKCS1_v1_5.new(RSA.importKey(
-            binascii.unhexlify(self.private_key)))
-        h = SHA256.new((str(sender) + str(recipient) +
-                       str(amount)).encode('utf8'))
-        signature = signer.sign(h)
+        # Parsing the key is expensive, so the signer is kept until the private key changes
+        if self.__signer_key != self.private_key:
+            key = binascii.unhexlify(self.private_key)
+            if self.key_scheme(self.private_key) == SCHEME_ED25519:
+                self.__signer = eddsa.new(ECC.import_key(key), 'rfc8032')
+            else:
+                self.__signer = PKCS1_v1_5.new(RSA.importKey(key))
+            self.__signer_key = self.private_key
+        message = self.transaction_message(sender, recipient, amount)
+        if self.key_scheme(self.private_key) == SCHEME_ED25519:
+            signature = self.__signer.sign(message)
+        else:
+            signature = self.__signer.sign(SHA256.new(message))
         return binascii.hexlify(signature).decode('ascii')
 
     @staticmethod
@@ -85,8 +141,27 @@ class Wallet:
         Arguments:
             transaction: The transaction that should be verified.
         """
-        public_key = RSA.importKey(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) +
-                       str(transaction.amount)).encode('utf8'))
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        verifier = Wallet.load_verifier(transaction.sender)
+        message = Wallet.transaction_message(
+            transaction.sender, transaction.recipient, transaction.amount)
+        signature = binascii.unhexlify(transaction.signature)
+        if Wallet.key_scheme(transaction.sender) == SCHEME_ED25519:
+            try:
+                verifier.verify(message, signature)
+                return True
+            except ValueError:
+                return False
+        return verifier.verify(SHA256.new(message), signature)
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def load_verifier(public_key):
+        """Return a (cached) signature verifier for a hex encoded public key.
+
+        Arguments:
+            public_key: The public key of the signer.
+        """
+        key = binascii.unhexlify(public_key)
+        if Wallet.key_scheme(public_key) == SCHEME_ED25519:
+            return eddsa.new(ECC.import_key(key), 'rfc8032')
+        return PKCS1_v1_5.new(RSA.importKey(key))